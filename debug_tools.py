@@ -1,6 +1,9 @@
 # debug_tools.py
 # A clean, isolated debug collector that stays silent unless activated.
 
+import contextvars
+
+
 class DebugCollector:
     """
     A structured container for collecting debug information across the pipeline.
@@ -114,5 +117,34 @@ class DebugCollector:
         return "\n".join(report)
 
 
-# A single global collector instance that the pipeline can import.
-DEBUG = DebugCollector()
+# The collector of the request running in the current context.
+_CURRENT = contextvars.ContextVar("debug_collector", default=None)
+
+
+class RequestDebug:
+    """
+    Stands in for the current request's collector, so the pipeline keeps
+    calling DEBUG.add_flow(...) while requests served side by side (server
+    threads) each fill a report of their own.
+    Outside a request, calls go to a process-wide collector; enabling that
+    one enables every request started afterwards.
+    Helper threads see the request's collector only when run inside a copy
+    of its context (contextvars.copy_context().run).
+    """
+
+    def __init__(self):
+        self._default = DebugCollector()
+
+    def start_request(self):
+        """Bind a fresh collector to the current context and return it."""
+        collector = DebugCollector()
+        collector.enabled = self._default.enabled
+        _CURRENT.set(collector)
+        return collector
+
+    def __getattr__(self, name):
+        return getattr(_CURRENT.get() or self._default, name)
+
+
+# A single global instance that the pipeline can import.
+DEBUG = RequestDebug()
@@ -1,20 +1,27 @@
 import pdfplumber
-import subprocess
 import tempfile
 import os
 import re
+import sys
+from itertools import groupby
+from operator import itemgetter
 
 from debug_tools import DEBUG  # Debug collector
+from page_pool import map_page_batches, page_count, submit_to_pool
 
 
 # --- LOAD LISTS ---
 def load_list(path):
+    # Read-only after load; interned so set probes compare by identity first
     with open(path, encoding="utf-8") as f:
-        return set(line.strip().lower() for line in f if line.strip())
+        return frozenset(sys.intern(line.strip().lower()) for line in f if line.strip())
 
 
 STOPWORDS = load_list("stopwords.txt")
 
+# Edge punctuation ignored when checking a token against STOPWORDS
+TOKEN_STRIP_CHARS = ".,;:()[]{}"
+
 
 # --- GARBAGE FILTER (KEPT EXACTLY AS IS) ---
 def is_garbage_phrase(text):
@@ -31,11 +38,23 @@ def is_garbage_phrase(text):
 
 
 # --- OCR STEP ---
+# Tesseract processes for one document. OCR runs while the page pool renders
+# the upload on every core, so it gets half of them rather than all.
+OCR_JOBS = max(1, (os.cpu_count() or 1) // 2)
+
+
 def ocr_pdf(input_path):
     try:
         import fitz
-        doc = fitz.open(input_path)
-        if any(page.get_text("text").strip() for page in doc):
+        # Yes/no probe: stop at the first page with embedded text, skip
+        # ligature/whitespace post-processing, and close the document
+        # before OCR reopens the file.
+        with fitz.open(input_path) as doc:
+            has_text = any(
+                page.get_text("text", flags=fitz.TEXT_MEDIABOX_CLIP).strip()
+                for page in doc
+            )
+        if has_text:
             print("\n=== OCR SKIPPED: Embedded text detected ===")
             DEBUG.add_flow("ocr_skipped_embedded_text")
             return None
@@ -46,9 +65,17 @@ def ocr_pdf(input_path):
         print("\n=== OCR STEP ===")
         DEBUG.add_flow("ocr_triggered")
 
-        subprocess.run(
-            ["ocrmypdf", "--force-ocr", "--deskew", "--clean", input_path, cleaned_path],
-            check=True
+        # In-process API: no fresh interpreter/import per document, and
+        # jobs= lets Tesseract work on pages in parallel.
+        import ocrmypdf
+        ocrmypdf.ocr(
+            input_path,
+            cleaned_path,
+            force_ocr=True,
+            deskew=True,
+            clean=True,
+            jobs=OCR_JOBS,
+            progress_bar=False
         )
         return cleaned_path
     except Exception as e:
@@ -57,6 +84,93 @@ def ocr_pdf(input_path):
         return None
 
 
+def _ocr_pdf_worker(input_path):
+    # Worker entry point: the worker can't reach the parent's DEBUG, so
+    # collect ocr_pdf's flow here and hand it back with the result
+    collector = DEBUG.start_request()
+    collector.enable()
+    return ocr_pdf(input_path), collector.flow
+
+
+def start_ocr_pdf(input_path):
+    """
+    Start ocr_pdf in a worker process and return a function that waits
+    for it and returns the cleaned PDF path (or None). PyMuPDF must not be
+    used from two threads of one process, so this lets the caller render
+    pages while the embedded-text probe and OCR run elsewhere.
+    """
+    future = submit_to_pool(_ocr_pdf_worker, input_path)
+
+    def collect():
+        try:
+            cleaned_pdf, flow = future.result()
+        except Exception as e:
+            print(f"OCR FAILED: {e}")
+            DEBUG.add_flow(f"ocr_failed:{e}")
+            return None
+        for step in flow:
+            DEBUG.add_flow(step)
+        return cleaned_pdf
+
+    return collect
+
+
+# --- PDF BACKENDS ---
+# "pdfplumber" (default) or "pymupdf". PyMuPDF returns whole words with
+# bounding boxes straight from its C core, skipping pdfplumber's
+# per-character Python objects; pdfplumber stays the reference backend.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "pdfplumber").strip().lower()
+
+
+def _pdfplumber_page_words(page):
+    try:
+        return page.extract_words(
+            use_text_flow=False,
+            keep_blank_chars=False,
+            x_tolerance=1,
+            y_tolerance=2
+        ) or []
+    except Exception:
+        return []
+
+
+def _pymupdf_page_words(page):
+    try:
+        raw = page.get_text("words")
+    except Exception:
+        return []
+    # (x0, y0, x1, y1, text, block_no, line_no, word_no) -> pdfplumber schema
+    return [
+        {"text": w[4], "x0": w[0], "top": w[1], "x1": w[2], "bottom": w[3]}
+        for w in raw
+    ]
+
+
+def iter_page_words(pdf_path, page_indices):
+    """
+    Yield (page_index, page_width, page_height, raw_words) for the given pages.
+    raw_words always use pdfplumber's x0/top/x1/bottom keys, whichever
+    backend PDF_BACKEND selects.
+    """
+    if PDF_BACKEND == "pymupdf":
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            for page_index in page_indices:
+                page = doc[page_index]
+                yield page_index, page.rect.width, page.rect.height, _pymupdf_page_words(page)
+        return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_index in page_indices:
+            page = pdf.pages[page_index]
+            raw_words = _pdfplumber_page_words(page)
+            page_width, page_height = page.width, page.height
+            # pdfplumber keeps every char/layout object cached on the Page
+            # until closed; release it so memory stays flat across pages.
+            page.close()
+            yield page_index, page_width, page_height, raw_words
+
+
 # --- ANOMALY HELPERS ---
 def detect_duplicate_coordinates(all_words):
     """
@@ -177,123 +291,142 @@ def detect_overlapping_boxes(all_words, max_checks=1000):
                     DEBUG.add_anomaly("overlapping_boxes", sample)
 
 
+# --- PER-PAGE EXTRACTION ---
+def process_page(page_index, page_width, page_height, raw_words, meta):
+    """
+    Scale one page's raw words into rendered-image space, sort them into
+    reading order, merge hyphenated line breaks and flag stopwords, all in
+    one pass over the sorted rows.
+    Returns (page_info, words, is_stop). Touches no shared state, so pages
+    can be processed in any order or process.
+    """
+    scale_x = meta["rendered_width"] / meta["pdf_width"]
+    scale_y = meta["rendered_height"] / meta["pdf_height"]
+
+    # Column tuples (row, x, seq, y, width, height, text): sorting compares
+    # native tuples instead of calling a key lambda, and dicts are only
+    # built for words that survive hyphen merging. seq keeps the sort stable.
+    rows = []
+    for seq, w in enumerate(raw_words):
+        text = w.get("text", "")
+        if not text:
+            continue
+        x = float(w["x0"]) * scale_x
+        y = float(w["top"]) * scale_y
+        rows.append((
+            round(y / 5),
+            x,
+            seq,
+            y,
+            float(w["x1"] - w["x0"]) * scale_x,
+            float(w["bottom"] - w["top"]) * scale_y,
+            text,
+        ))
+
+    # Sort by reading order
+    rows.sort()
+
+    # --- KEEP HYPHEN MERGING EXACTLY AS IS ---
+    page_number = page_index + 1
+    stopwords = STOPWORDS
+    strip_chars = TOKEN_STRIP_CHARS
+    merged = []
+    is_stop = []
+    n = len(rows)
+    i = 0
+    while i < n:
+        _, x, _, y, width, height, text = rows[i]
+        if text.endswith("-") and (i + 1) < n:
+            text = text.rstrip("-") + rows[i + 1][6]
+            i += 2
+        else:
+            i += 1
+        merged.append({
+            "text": text,
+            "x": x,
+            "y": y,
+            "width": width,
+            "height": height,
+            "page": page_number
+        })
+        is_stop.append(text.lower().strip(strip_chars) in stopwords)
+
+    page_info = {
+        "page_number": page_number,
+        "width": float(page_width),
+        "height": float(page_height)
+    }
+    return page_info, merged, is_stop
+
+
+def _extract_page_batch(pdf_path, page_indices, render_metadata):
+    # Worker entry point: each process opens the PDF itself
+    return [
+        process_page(page_index, width, height, raw_words, render_metadata[page_index])
+        for page_index, width, height, raw_words in iter_page_words(pdf_path, page_indices)
+    ]
+
+
 # --- MAIN EXTRACTION FUNCTION ---
-def extract_pdf_layout(pdf_path, render_metadata):
+def extract_pdf_layout(pdf_path, render_metadata, run_ocr=True):
+    """
+    Extract words and phrases from the PDF. With run_ocr=False the caller
+    has already run ocr_pdf (e.g. alongside rendering) and pdf_path is the
+    file to read.
+    """
     print("\n=== STARTING EXTRACTION ===")
     DEBUG.add_flow("extraction_started")
     DEBUG.add_flow("render_metadata_received")
 
-    cleaned_pdf = ocr_pdf(pdf_path)
-    target_pdf = cleaned_pdf if cleaned_pdf else pdf_path
+    if run_ocr:
+        cleaned_pdf = ocr_pdf(pdf_path)
+        target_pdf = cleaned_pdf if cleaned_pdf else pdf_path
 
-    if cleaned_pdf:
-        DEBUG.add_flow("using_ocr_cleaned_pdf")
+        if cleaned_pdf:
+            DEBUG.add_flow("using_ocr_cleaned_pdf")
+        else:
+            DEBUG.add_flow("using_original_pdf_no_ocr")
     else:
-        DEBUG.add_flow("using_original_pdf_no_ocr")
+        target_pdf = pdf_path
 
     all_words = []
+    is_stop = []
     pages_output = []
 
-    # --- EXTRACT WORDS ---
-    DEBUG.add_flow("pdfplumber_extraction_started")
-    with pdfplumber.open(target_pdf) as pdf:
-        for page_index, page in enumerate(pdf.pages):
-            meta = render_metadata[page_index]
-            scale_x = meta["rendered_width"] / meta["pdf_width"]
-            scale_y = meta["rendered_height"] / meta["pdf_height"]
-
-            try:
-                raw_words = page.extract_words(
-                    use_text_flow=False,
-                    keep_blank_chars=False,
-                    x_tolerance=1,
-                    y_tolerance=2,
-                    extra_attrs=["fontname", "size"]
-                ) or []
-            except Exception:
-                raw_words = []
-
-            normalized = []
-            for w in raw_words:
-                text = w.get("text", "")
-                if not text:
-                    continue
-                normalized.append({
-                    "text": text,
-                    "x": float(w["x0"]) * scale_x,
-                    "y": float(w["top"]) * scale_y,
-                    "width": float(w["x1"] - w["x0"]) * scale_x,
-                    "height": float(w["bottom"] - w["top"]) * scale_y,
-                    "page": page_index + 1
-                })
-
-            # Sort by reading order
-            normalized.sort(key=lambda w: (round(w["y"] / 5), w["x"]))
-
-            # --- KEEP HYPHEN MERGING EXACTLY AS IS ---
-            merged = []
-            i = 0
-            while i < len(normalized):
-                current = normalized[i]
-                if current["text"].endswith("-") and (i + 1) < len(normalized):
-                    nxt = normalized[i + 1]
-                    current["text"] = current["text"].rstrip("-") + nxt["text"]
-                    merged.append(current)
-                    i += 2
-                else:
-                    merged.append(current)
-                    i += 1
-
-            all_words.extend(merged)
-            pages_output.append({
-                "page_number": page_index + 1,
-                "width": float(page.width),
-                "height": float(page.height)
-            })
+    # --- EXTRACT WORDS (pages in parallel, results in page order) ---
+    DEBUG.add_flow(f"word_extraction_started:{PDF_BACKEND}")
+    n_pages = page_count(target_pdf)
+    for page_info, words, page_is_stop in map_page_batches(
+        _extract_page_batch, target_pdf, n_pages, render_metadata
+    ):
+        all_words.extend(words)
+        is_stop.extend(page_is_stop)
+        pages_output.append(page_info)
 
-    DEBUG.add_flow("pdfplumber_extraction_completed")
+    DEBUG.add_flow("word_extraction_completed")
 
     # Sample page-level metadata as "boxes" (complements server samples)
     for page_info in pages_output[:5]:
         DEBUG.add_sample("boxes", page_info)
 
-    # --- SORT ALL WORDS GLOBALLY ---
-    all_words.sort(key=lambda w: (w["page"], round(w["y"] / 5), w["x"]))
+    # Words are already in global reading order: pages arrive in page order
+    # and each page was sorted by (row, x) in process_page.
 
     # ============================================================
     # ⭐ PURE GREEDY STOPWORD-BOUNDED EXTRACTION (NO MAX LENGTH)
     # ============================================================
 
+    # Stopword flags come from process_page; a phrase is simply a maximal
+    # run of consecutive non-stopwords, so boundaries fall out of one
+    # groupby pass.
     phrases = []
-    n = len(all_words)
-    i = 0
-
-    while i < n:
-        w = all_words[i]
-        raw = w["text"]
-
-        # Clean token for stopword check
-        token = raw.lower().strip(".,;:()[]{}")
-
+    for stop, run in groupby(zip(is_stop, all_words), key=itemgetter(0)):
         # Skip stopwords entirely
-        if token in STOPWORDS:
-            i += 1
+        if stop:
             continue
 
-        # Start a new greedy phrase
-        phrase_words = [w]
-        j = i + 1
-
-        # Expand right until a stopword
-        while j < n:
-            nxt_raw = all_words[j]["text"]
-            nxt_token = nxt_raw.lower().strip(".,;:()[]{}")
-
-            if nxt_token in STOPWORDS:
-                break  # stop expansion
-
-            phrase_words.append(all_words[j])
-            j += 1
+        phrase_words = [w for _, w in run]
+        w = phrase_words[0]
 
         # Emit phrase (even if length 1)
         phrase_text = " ".join([pw["text"] for pw in phrase_words]).strip()
@@ -312,12 +445,9 @@ def extract_pdf_layout(pdf_path, render_metadata):
         if not rejected:
             phrases.append({
                 "text": phrase_text,
-                "words": phrase_words.copy()
+                "words": phrase_words
             })
 
-        # Move index to next word after phrase
-        i = j
-
     DEBUG.add_flow("phrase_extraction_completed")
 
     # --- ANOMALY DETECTION ON WORDS ---
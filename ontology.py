@@ -1,5 +1,14 @@
 import requests
 import re
+import orjson
+import string
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from term_cache import TERM_CACHE
 
 # ---------------------------------------------------------
 # LOAD LISTS
@@ -9,8 +18,8 @@ def load_definitions(path):
     defs = {}
     with open(path, encoding="utf-8") as f:
         for line in f:
-            if "<TAB>" in line:
-                term, definition = line.strip().split("<TAB>", 1)
+            term, sep, definition = line.strip().partition("<TAB>")
+            if sep:
                 defs[term.lower()] = definition.strip()
     return defs
 
@@ -18,8 +27,8 @@ def load_synonyms(path):
     mapping = {}
     with open(path, encoding="utf-8") as f:
         for line in f:
-            if "<-" in line:
-                canonical, variants = line.strip().split("<-", 1)
+            canonical, sep, variants = line.strip().partition("<-")
+            if sep:
                 canonical = canonical.strip().lower()
                 for variant in variants.split(","):
                     mapping[variant.strip().lower()] = canonical
@@ -33,10 +42,30 @@ SYNONYMS = load_synonyms("synonyms.txt")
 # NORMALIZATION (for dedupe only)
 # ---------------------------------------------------------
 
+_NON_TERM_CHARS_RE = re.compile(r"[^a-z0-9\- ]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# ASCII fast path: one C-level translate deletes every char the regex would
+_DROP_NON_TERM_ASCII = str.maketrans("", "", "".join(
+    c for c in map(chr, range(128))
+    if not (c in string.ascii_lowercase or c in string.digits or c in "- ")
+))
+
+# Terms recur across pages and each is normalized for dedupe, the
+# searchability check and its cache key; memoize the repeats.
+@lru_cache(maxsize=16384)
 def normalize_term(t: str) -> str:
     t = t.lower().strip()
-    t = re.sub(r"[^a-z0-9\- ]", "", t)
-    t = re.sub(r"\s+", " ", t)
+    if t.isascii():
+        # Most tokens are already plain letters/digits: nothing to drop
+        if t.isalnum():
+            return t
+        t = t.translate(_DROP_NON_TERM_ASCII)
+    else:
+        t = _NON_TERM_CHARS_RE.sub("", t)
+    # Only spaces survive the filter, so collapsing is needed only for runs
+    if "  " in t:
+        t = _WHITESPACE_RE.sub(" ", t)
     return t
 
 # ---------------------------------------------------------
@@ -48,42 +77,154 @@ BIOPORTAL_API_KEY = "7e84a21d-3f8e-4837-b7a9-841fb4847ddf"
 
 MAX_TERMS_PER_DOCUMENT = 1000
 MAX_BIOPORTAL_LOOKUPS = 1000
+BIOPORTAL_WORKERS = 16
+
+# One pooled session so every lookup reuses a kept-alive TLS connection
+# instead of paying a fresh handshake per term. Sockets are opened on first
+# use, so a session created before a preforking server forks is still safe.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=BIOPORTAL_WORKERS,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
+# Lookup threads are shared by every request instead of being spawned and
+# joined per batch; created on first use so no threads exist at import.
+_LOOKUP_POOL = None
+_LOOKUP_POOL_LOCK = threading.Lock()
+
+def _lookup_pool():
+    global _LOOKUP_POOL
+    with _LOOKUP_POOL_LOCK:
+        if _LOOKUP_POOL is None:
+            _LOOKUP_POOL = ThreadPoolExecutor(
+                max_workers=BIOPORTAL_WORKERS,
+                thread_name_prefix="bioportal"
+            )
+        return _LOOKUP_POOL
 
 # ---------------------------------------------------------
 # BIOPORTAL LOOKUP (using ORIGINAL phrase/word)
 # ---------------------------------------------------------
 
-def lookup_term_bioportal(original_phrase: str):
-    if not original_phrase.strip():
-        return None
+def _cache_key(term: str) -> str:
+    # Normalized so citation-style variants ("(RNAi)", "RNAi,") share one
+    # entry; namespaced by endpoint so another source can share the store.
+    return "bioportal:" + (normalize_term(term) or term.strip().lower())
+
+def is_searchable_term(term: str) -> bool:
+    """
+    Cheap local filter for terms BioPortal never matches usefully:
+    fewer than 3 term characters, or no letter at all ("12", "3.5", "--").
+    """
+    norm = normalize_term(term)
+    return len(norm) >= 3 and any(c.isalpha() for c in norm)
 
+def fetch_term_bioportal(original_phrase: str):
+    """
+    Query BioPortal directly (no cache read) and cache the answer.
+    A clean "no match" is cached as a negative entry. Network, HTTP and
+    parse errors are raised, not cached, so a flaky call is retried next
+    time and the caller can tell it apart from a miss.
+    """
     params = {
         "q": original_phrase,
         "apikey": BIOPORTAL_API_KEY,
-        "require_exact_match": "false"
+        "require_exact_match": "false",
+        # Only the fields read below; drops the JSON-LD context and links
+        # that make up most of each result
+        "include": "prefLabel,definition",
+        "display_context": "false",
+        "display_links": "false"
     }
 
+    r = _SESSION.get(BIOPORTAL_SEARCH_URL, params=params, timeout=3)
+    r.raise_for_status()
+    data = orjson.loads(r.content)
+
+    for item in data.get("collection", []):
+        label = item.get("prefLabel") or item.get("label")
+        defs = item.get("definition")
+        definition = defs[0] if isinstance(defs, list) and defs else defs
+
+        if label and definition:
+            hit = {
+                "label": label,
+                "definition": definition,
+                "iri": item.get("@id", "")
+            }
+            TERM_CACHE.set(_cache_key(original_phrase), hit)
+            return hit
+
+    TERM_CACHE.set(_cache_key(original_phrase), None)
+    return None
+
+# Fetches in flight, by cache key. Concurrent requests for documents that
+# share vocabulary wait on the same future instead of querying twice.
+_IN_FLIGHT = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+def _fetch_and_release(key, term):
     try:
-        r = requests.get(BIOPORTAL_SEARCH_URL, params=params, timeout=3)
-        r.raise_for_status()
-        data = r.json()
-
-        for item in data.get("collection", []):
-            label = item.get("prefLabel") or item.get("label")
-            defs = item.get("definition")
-            definition = defs[0] if isinstance(defs, list) and defs else defs
-
-            if label and definition:
-                return {
-                    "label": label,
-                    "definition": definition,
-                    "iri": item.get("@id", "")
-                }
+        return fetch_term_bioportal(term)
+    finally:
+        # The answer is cached by now, so later callers find it there
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.pop(key, None)
+
+def _fetch_single_flight(key, term):
+    """Return a future for `key`, joining a fetch already in flight."""
+    with _IN_FLIGHT_LOCK:
+        future = _IN_FLIGHT.get(key)
+        if future is None:
+            future = _lookup_pool().submit(_fetch_and_release, key, term)
+            _IN_FLIGHT[key] = future
+        return future
+
+def lookup_terms_bioportal(terms, failed=None):
+    """
+    Look up many terms at once; returns {term: hit or None}.
+    A term whose request failed maps to None and, if a `failed` list is
+    given, is appended to it.
+    Terms that fail is_searchable_term are left out and never queried.
+    Terms that share a cache key are queried once. Cached terms are answered from a single
+    batched cache read, so only genuinely new terms reach the thread pool,
+    where each request spends nearly all its time waiting on the network.
+    """
+    unique = list(dict.fromkeys(t for t in terms if is_searchable_term(t)))
+    if not unique:
+        return {}
+
+    keys = {t: _cache_key(t) for t in unique}
+    cached = TERM_CACHE.get_many(list(dict.fromkeys(keys.values())))
+
+    results = {}
+    misses = {}  # cache key -> representative term sent to BioPortal
+    for term in unique:
+        key = keys[term]
+        if key in cached:
+            results[term] = cached[key]  # None when known to have no match
+        else:
+            misses.setdefault(key, term)
+
+    fetching = {key: _fetch_single_flight(key, term) for key, term in misses.items()}
 
-        return None
+    # Variants that normalize alike share the one answer
+    for term in unique:
+        if term not in results:
+            try:
+                results[term] = fetching[keys[term]].result()
+            except Exception:
+                results[term] = None
+                if failed is not None:
+                    failed.append(term)
 
-    except Exception:
-        return None
+    return results
+
+def lookup_term_bioportal(original_phrase: str):
+    """Look up one term through the same cache read as the batch path."""
+    return lookup_terms_bioportal([original_phrase]).get(original_phrase)
 
 # ---------------------------------------------------------
 # INTERNAL LOOKUP HELPERS
@@ -130,19 +271,25 @@ def extract_ontology_terms(extracted):
 
     results = {}          # term_text -> info dict
     unmatched_terms = []  # list of phrase/word texts with no definition
+    failed_lookups = []   # terms whose BioPortal request errored
 
     # ---------------------------------------------
-    # STEP 1 — BUCKET BY LENGTH
+    # STEP 1 + 2 — BUCKET BY LENGTH, RESOLVE PHRASES INTERNALLY
     # ---------------------------------------------
-    one_word_spans = []   # list of phrase dicts with length == 1
-    two_word_spans = []   # list of phrase dicts with length == 2
-    multi_word_spans = [] # list of phrase dicts with length >= 3
+    # One pass over the phrases: 1-word spans seed the 1-word bucket, and
+    # 2-word / 3+ word phrases try phrase_definitions.txt straight away.
+    # A phrase text resolves the same way every time, so repeats are skipped.
+    seen_texts = set()
+    one_word_terms = []         # 1-word *terms* to resolve at the end (strings, not spans)
+    unresolved_two_word = []    # 2-word phrase dicts with no internal definition
+    unresolved_multi_word = []  # 3+ word phrase dicts with no internal definition
 
     for p in phrases:
         text = p.get("text", "").strip()
-        words_meta = p.get("words") or []
-        if not text:
+        if not text or text in seen_texts:
             continue
+        seen_texts.add(text)
+        words_meta = p.get("words") or []
 
         # Prefer length from words metadata; fallback to splitting text
         if words_meta:
@@ -151,46 +298,38 @@ def extract_ontology_terms(extracted):
             length = len(text.split())
 
         if length == 1:
-            one_word_spans.append(p)
-        elif length == 2:
-            two_word_spans.append(p)
-        else:
-            multi_word_spans.append(p)
-
-    # Bucket for 1-word *terms* to resolve at the end (strings, not spans)
-    one_word_terms = []
-
-    # Seed 1-word terms from original 1-word spans
-    for p in one_word_spans:
-        text = p.get("text", "").strip()
-        if text:
             one_word_terms.append(text)
-
-    bioportal_lookups = 0
-
-    # ---------------------------------------------
-    # STEP 2 — PROCESS 2-WORD PHRASES
-    # ---------------------------------------------
-    for p in two_word_spans:
-        phrase_text = p.get("text", "").strip()
-        if not phrase_text:
             continue
 
         # A. internal phrase definitions
-        hit = lookup_internal_phrase(phrase_text)
+        hit = lookup_internal_phrase(text)
         if hit:
-            results[phrase_text] = {
+            results[text] = {
                 "source": "phrase_definition",
                 "definition": hit
             }
-            continue
-
-        # B. BioPortal phrase lookup
-        if bioportal_lookups < MAX_BIOPORTAL_LOOKUPS:
-            bp = lookup_term_bioportal(phrase_text)
-            bioportal_lookups += 1
+        elif length == 2:
+            unresolved_two_word.append(p)
         else:
-            bp = None
+            unresolved_multi_word.append(p)
+
+    # BioPortal budget is spent in order: 2-word phrases, 3+ word phrases,
+    # then 1-word terms. Each unique term costs one lookup.
+    bioportal_budget = MAX_BIOPORTAL_LOOKUPS
+    unresolved_phrases = unresolved_two_word + unresolved_multi_word
+
+    # B. BioPortal phrase lookup (concurrent, within budget)
+    phrase_terms = [p.get("text", "").strip() for p in unresolved_phrases]
+    phrase_terms = phrase_terms[:bioportal_budget]
+    bioportal_budget -= len(phrase_terms)
+    phrase_hits = lookup_terms_bioportal(phrase_terms, failed_lookups)
+
+    # ---------------------------------------------
+    # STEP 3 — RESOLVE PHRASES OR FALL BACK
+    # ---------------------------------------------
+    for p in unresolved_phrases:
+        phrase_text = p.get("text", "").strip()
+        bp = phrase_hits.get(phrase_text)
 
         if bp:
             results[phrase_text] = {
@@ -200,52 +339,25 @@ def extract_ontology_terms(extracted):
             }
             continue
 
-        # C. If still no match → split into 1-word terms and add to 1-word bucket
         words_meta = p.get("words") or []
         if words_meta:
-            split_words = [w.get("text", "").strip() for w in words_meta if w.get("text", "").strip()]
+            length = len(words_meta)
         else:
-            split_words = [w.strip() for w in phrase_text.split() if w.strip()]
-
-        for w in split_words:
-            one_word_terms.append(w)
-
-        # No result stored for the 2-word phrase itself at this stage
-
-    # ---------------------------------------------
-    # STEP 3 — PROCESS 3+ WORD PHRASES
-    # ---------------------------------------------
-    for p in multi_word_spans:
-        phrase_text = p.get("text", "").strip()
-        if not phrase_text:
-            continue
+            length = len(phrase_text.split())
 
-        # A. internal phrase definitions
-        hit = lookup_internal_phrase(phrase_text)
-        if hit:
-            results[phrase_text] = {
-                "source": "phrase_definition",
-                "definition": hit
-            }
+        # C. 3+ words with no match → stop, no definition, no highlight
+        if length >= 3:
+            unmatched_terms.append(phrase_text)
             continue
 
-        # B. BioPortal phrase lookup
-        if bioportal_lookups < MAX_BIOPORTAL_LOOKUPS:
-            bp = lookup_term_bioportal(phrase_text)
-            bioportal_lookups += 1
+        # C. 2 words with no match → split into 1-word terms for the 1-word bucket
+        if words_meta:
+            split_words = [w.get("text", "").strip() for w in words_meta if w.get("text", "").strip()]
         else:
-            bp = None
-
-        if bp:
-            results[phrase_text] = {
-                "source": "ontology_phrase",
-                "definition": bp["definition"],
-                "iri": bp.get("iri", "")
-            }
-            continue
+            split_words = [w.strip() for w in phrase_text.split() if w.strip()]
 
-        # C. If still no match → stop, no definition, no highlight
-        unmatched_terms.append(phrase_text)
+        for w in split_words:
+            one_word_terms.append(w)
 
     # ---------------------------------------------
     # STEP 4 — PROCESS 1-WORD TERMS (LAST)
@@ -266,10 +378,12 @@ def extract_ontology_terms(extracted):
     if len(all_norms) > MAX_TERMS_PER_DOCUMENT:
         all_norms = all_norms[:MAX_TERMS_PER_DOCUMENT]
 
+    unresolved_words = []  # (originals, representative) with no internal definition
+
     for norm in all_norms:
-        originals = sorted(norm_to_originals[norm])
-        # Representative word for lookup
-        rep = originals[0]
+        originals = norm_to_originals[norm]
+        # Representative word for lookup (lexicographically smallest spelling)
+        rep = min(originals)
 
         # Apply synonyms only at 1-word level
         lookup_key = apply_synonym_lookup(rep)
@@ -284,12 +398,14 @@ def extract_ontology_terms(extracted):
                 }
             continue
 
-        # BioPortal word lookup
-        if bioportal_lookups < MAX_BIOPORTAL_LOOKUPS:
-            bp = lookup_term_bioportal(rep)
-            bioportal_lookups += 1
-        else:
-            bp = None
+        unresolved_words.append((originals, rep))
+
+    # BioPortal word lookup (concurrent, within remaining budget)
+    word_terms = [rep for _, rep in unresolved_words][:max(bioportal_budget, 0)]
+    word_hits = lookup_terms_bioportal(word_terms, failed_lookups)
+
+    for originals, rep in unresolved_words:
+        bp = word_hits.get(rep)
 
         if bp:
             for word in originals:
@@ -308,4 +424,5 @@ def extract_ontology_terms(extracted):
     # STEP 5 — RETURN RESULTS
     # ---------------------------------------------
     results["_unmatched"] = unmatched_terms
+    results["_lookup_failed"] = failed_lookups
     return results
@@ -0,0 +1,120 @@
+# page_pool.py
+# Fan per-page PDF work out over worker processes.
+#
+# PyMuPDF isn't thread-safe and the server handles several requests per
+# process on threads, so every PDF open goes through this pool rather than
+# running on a request thread.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# One long-lived pool per server process, shared by extraction and
+# rendering, so requests don't pay for starting fresh workers each time.
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def _warm_worker():
+    """Import the PDF libraries once per worker, not once per batch."""
+    import fitz  # noqa: F401
+    import pdfplumber  # noqa: F401
+
+
+def _get_pool():
+    """
+    Create the pool on first use. A pool inherited across fork() belongs
+    to the parent, so a forked server worker builds its own.
+    Workers come from a fork server rather than fork(): the server process
+    has live request threads, lookup threads and a SQLite connection by the
+    time the pool starts, none of which survive being forked.
+    """
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            _POOL = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_warm_worker
+            )
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+def _discard_pool(pool):
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_to_pool(fn, *args):
+    """
+    Start fn(*args) in a pool worker and return its future.
+    fn must be a top-level function so it can be pickled. If the call
+    fails because a worker died, the broken pool is dropped.
+    """
+    pool = _get_pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+    def _check(done):
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            _discard_pool(pool)
+
+    future.add_done_callback(_check)
+    return future
+
+
+def _count_pages(pdf_path):
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def page_count(pdf_path):
+    """Number of pages in the PDF, read in a pool worker."""
+    return submit_to_pool(_count_pages, pdf_path).result()
+
+
+def page_batches(n_pages):
+    """
+    Split page indices 0..n_pages-1 into contiguous batches.
+    Every batch reopens the PDF in its worker, so small documents use
+    fixed-size batches and large ones get one batch per CPU.
+    """
+    if n_pages < 10:
+        size = 5
+    elif n_pages < 50:
+        size = 10
+    else:
+        workers = os.cpu_count() or 1
+        size = -(-n_pages // workers)
+    return [range(start, min(start + size, n_pages)) for start in range(0, n_pages, size)]
+
+
+def map_page_batches(fn, pdf_path, n_pages, *args):
+    """
+    Call fn(pdf_path, page_indices, *args) for every batch and return the
+    per-batch result lists concatenated in page order.
+    fn must be a top-level function so it can be pickled. Even a single
+    batch runs in the pool, to keep the PDF off the caller's thread.
+    """
+    batches = page_batches(n_pages)
+    n = len(batches)
+    pool = _get_pool()
+    try:
+        results = pool.map(fn, [pdf_path] * n, batches, *[[arg] * n for arg in args])
+        return [item for batch in results for item in batch]
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); don't reuse the pool
+        _discard_pool(pool)
+        raise
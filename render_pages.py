@@ -1,13 +1,117 @@
+import logging
 import os
 import tempfile
 import fitz  # PyMuPDF
+from PIL import Image
 
 from debug_tools import DEBUG  # Debug collector
+from page_pool import map_page_batches, page_count
+
+log = logging.getLogger(__name__)
+
+# --- PAGE FOLDER ---
+# Where rendered pages are written and served from. On Cloud Run /tmp is
+# already memory-backed; elsewhere point this at a tmpfs such as /dev/shm
+# (sized for a few documents' worth of images) to keep page writes in RAM.
+PAGE_FOLDER = os.environ.get("PAGE_FOLDER", "/tmp/pages")
+
+# --- PAGE IMAGE FORMAT ---
+# "webp" (default), "jpeg" or "png". WebP pages are roughly half the size
+# of JPEG and a third smaller than PNG (~123 KB vs ~215 KB vs ~194 KB for a
+# Letter page at 150 dpi), which is what the browser waits on; encoding
+# takes ~65 ms at method 2 against ~9 ms for Pillow's libjpeg-turbo and
+# ~45 ms for PNG's DEFLATE. "jpeg" favours encode time; "png" is lossless.
+PAGE_IMAGE_FORMAT = os.environ.get("PAGE_IMAGE_FORMAT", "webp").strip().lower()
+JPEG_QUALITY = 80
+WEBP_QUALITY = 80
+WEBP_METHOD = 2  # 0-6; above 2 is ~2x slower for a few percent smaller files
+
+IMAGE_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+# --- PAGE SIZE ---
+# Pages are rendered to a fixed pixel width (what a US Letter page got at
+# the old fixed 150 dpi) rather than a fixed dpi, so wide or oversized pages
+# don't produce rasters far larger than the viewer shows. Pixel count grows
+# with zoom squared, so this bounds both rasterization and encoding.
+PAGE_TARGET_WIDTH = 1275
+MIN_ZOOM, MAX_ZOOM = 0.75, 2.5
+
+
+def _page_zoom(page, target_width_px):
+    zoom = target_width_px / page.rect.width if page.rect.width else 1.0
+    return min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+
+
+def _save_page_image(pix, filepath, image_format):
+    if image_format == "png":
+        pix.save(filepath)
+        return
+
+    # Wrap the pixmap's samples in place (no copy of the ~6 MB raster)
+    img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", 0, 1)
+    if image_format == "webp":
+        img.save(filepath, "WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+    else:
+        img.save(filepath, "JPEG", quality=JPEG_QUALITY)
+
+
+def _render_page_batch(pdf_path, page_indices, request_folder, unique_folder, zoom,
+                       target_width_px, image_format):
+    """
+    Worker entry point: render one batch of pages from its own handle on
+    the PDF. Returns one (page_number, meta, error) tuple per page; the
+    parent records the debug flow, since workers can't reach its DEBUG.
+    A zoom of None scales each page to target_width_px.
+    """
+    rendered = []
+
+    with fitz.open(pdf_path) as doc:
+        for i in page_indices:
+            page_number = i + 1
+
+            try:
+                page = doc[i]
+
+                # Render page
+                page_zoom = zoom or _page_zoom(page, target_width_px)
+                pix = page.get_pixmap(matrix=fitz.Matrix(page_zoom, page_zoom), alpha=False)
+
+                # Debug info (safe); formatted only when DEBUG logging is on
+                log.debug(
+                    "[RENDER DEBUG] Page %d: PyMuPDF page rect %sx%s, rendered image %dx%d",
+                    page_number, page.rect.width, page.rect.height, pix.width, pix.height
+                )
+
+                # Save image
+                filename = f"page_{page_number}.{IMAGE_EXTENSIONS[image_format]}"
+                filepath = os.path.join(request_folder, filename)
+                _save_page_image(pix, filepath, image_format)
+
+                # IMPORTANT: include rendered dimensions for extraction scaling
+                meta = {
+                    "page": page_number,
+                    "path": f"static/pages/{unique_folder}/{filename}",
+                    "rendered_width": pix.width,
+                    "rendered_height": pix.height,
+                    "pdf_width": page.rect.width,
+                    "pdf_height": page.rect.height
+                }
+
+                rendered.append((page_number, meta, None))
+
+            except Exception as e:
+                rendered.append((page_number, None, str(e)))
 
+    return rendered
 
-def render_pdf_pages(pdf_path, output_folder="/tmp/pages", dpi=150):
+
+def render_pdf_pages(pdf_path, output_folder=PAGE_FOLDER, dpi=None,
+                     image_format=PAGE_IMAGE_FORMAT, target_width_px=PAGE_TARGET_WIDTH):
     """
-    Render each page of the PDF as a PNG image using PyMuPDF (fitz).
+    Render each page of the PDF as an image (WebP by default, see
+    PAGE_IMAGE_FORMAT) using PyMuPDF (fitz).
+    Each page is scaled to target_width_px wide unless a fixed dpi is given.
+    Pages are rasterized and encoded in parallel worker processes.
     Returns metadata including rendered image dimensions
     so extraction can scale coordinates correctly.
     """
@@ -19,54 +123,35 @@ def render_pdf_pages(pdf_path, output_folder="/tmp/pages", dpi=150):
     request_folder = os.path.join(output_folder, unique_folder)
     os.makedirs(request_folder, exist_ok=True)
 
-    # Open PDF
-    doc = fitz.open(pdf_path)
-
-    # DPI → zoom factor
-    zoom = dpi / 72
-    matrix = fitz.Matrix(zoom, zoom)
+    n_pages = page_count(pdf_path)
 
-    images = []
-
-    for i, page in enumerate(doc):
-        page_number = i + 1
-        DEBUG.add_flow(f"render_page_start:{page_number}")
+    if image_format not in IMAGE_EXTENSIONS:
+        image_format = "png"
 
-        try:
-            # Render page
-            pix = page.get_pixmap(matrix=matrix, alpha=False)
+    # DPI → zoom factor (None: per-page zoom from target_width_px)
+    zoom = dpi / 72 if dpi else None
 
-            # Debug info (safe)
-            print(f"[RENDER DEBUG] Page {page_number}")
-            print(f"  PyMuPDF page rect: width={page.rect.width}, height={page.rect.height}")
-            print(f"  Rendered PNG size: width={pix.width}, height={pix.height}")
+    rendered = map_page_batches(
+        _render_page_batch, pdf_path, n_pages, request_folder, unique_folder,
+        zoom, target_width_px, image_format
+    )
 
-            # Save PNG
-            filename = f"page_{page_number}.png"
-            filepath = os.path.join(request_folder, filename)
-            pix.save(filepath)
+    images = []
 
-            # IMPORTANT: include rendered dimensions for extraction scaling
-            meta = {
-                "page": page_number,
-                "path": f"static/pages/{unique_folder}/{filename}",
-                "rendered_width": pix.width,
-                "rendered_height": pix.height,
-                "pdf_width": page.rect.width,
-                "pdf_height": page.rect.height
-            }
+    for page_number, meta, error in rendered:
+        DEBUG.add_flow(f"render_page_start:{page_number}")
 
-            images.append(meta)
+        if error is not None:
+            print(f"Error rendering page {page_number}: {error}", flush=True)
+            DEBUG.add_flow(f"render_page_error:{page_number}:{error}")
+            continue
 
-            # Add sample (capped by DebugCollector)
-            DEBUG.add_sample("boxes", meta)
+        images.append(meta)
 
-            DEBUG.add_flow(f"render_page_success:{page_number}")
+        # Add sample (capped by DebugCollector)
+        DEBUG.add_sample("boxes", meta)
 
-        except Exception as e:
-            print(f"Error rendering page {page_number}: {e}", flush=True)
-            DEBUG.add_flow(f"render_page_error:{page_number}:{e}")
-            continue
+        DEBUG.add_flow(f"render_page_success:{page_number}")
 
     # Count pages rendered
     DEBUG.set_count("pages", len(images))
@@ -0,0 +1,61 @@
+# response_cache.py
+# Remembers finished /extract responses, keyed by a hash of the upload.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    In-process LRU of encoded /extract responses. It is bounded by total
+    bytes rather than entry count, since one response can be a few KB or
+    several MB. Entries expire after `ttl` seconds so definitions picked
+    up by the ontology cache eventually reach repeat uploads too.
+    Each entry remembers the folder its page images were rendered into;
+    the images are served from disk, so a hit is only usable while that
+    folder still exists.
+    """
+
+    def __init__(self, max_bytes, ttl=24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (body, page_folder, stored)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        body, _, _ = self._entries.pop(key)
+        self._size -= len(body)
+
+    def get(self, key):
+        """Return (body, page_folder) for a fresh entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, page_folder, stored = entry
+            if time.time() - stored > self.ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, page_folder
+
+    def set(self, key, body, page_folder):
+        """Store encoded response bytes, evicting the oldest to fit."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (body, page_folder, time.time())
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+
+# A single shared cache for /extract responses (per server process).
+RESPONSE_CACHE = ResponseCache(
+    int(os.environ.get("RESPONSE_CACHE_BYTES", 128 * 1024 * 1024))
+)
@@ -48,7 +48,7 @@ document.getElementById("process-btn").addEventListener("click", async () => {
         output.innerHTML = "";
 
         // NEW: pass global words + pages
-        renderPages(data.pages, data.words, viewer);
+        renderPages(data.pages, wordsFromColumns(data.words), viewer);
 
         logBox.textContent = "Done.";
 
@@ -58,6 +58,24 @@ document.getElementById("process-btn").addEventListener("click", async () => {
     }
 });
 
+// The backend sends words as one array per field; zip them back into
+// one object per word (fields the backend left empty are omitted)
+function wordsFromColumns(columns) {
+    const fields = Object.keys(columns);
+    const count = columns.text.length;
+    const words = new Array(count);
+
+    for (let i = 0; i < count; i++) {
+        const word = {};
+        for (const field of fields) {
+            const value = columns[field][i];
+            if (value !== null) word[field] = value;
+        }
+        words[i] = word;
+    }
+    return words;
+}
+
 // Render pages + overlay text
 function renderPages(pages, allWords, viewer) {
     pages.forEach((page) => {
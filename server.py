@@ -1,35 +1,95 @@
 from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
+import hashlib
+import orjson
 import os
 import time
-from extract_text import extract_pdf_layout
-from render_pages import render_pdf_pages
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from extract_text import extract_pdf_layout, start_ocr_pdf
+from render_pages import render_pdf_pages, PAGE_FOLDER
 import ontology
 from debug_tools import DEBUG
+from response_cache import RESPONSE_CACHE
 
 # Uncomment this to globally enable debug collection.
 # You can also call DEBUG.enable() conditionally if you prefer.
 DEBUG.enable()
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson. The /extract payload holds every word
+    box on every page; orjson encodes it several times faster than the
+    stdlib encoder and hands back bytes without an extra str round trip.
+    """
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/*": {"origins": "https://cereuslydilutedscience.github.io"}})
 
 UPLOAD_FOLDER = "uploads"
-STATIC_PAGE_FOLDER = "/tmp/pages"
+STATIC_PAGE_FOLDER = PAGE_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(STATIC_PAGE_FOLDER, exist_ok=True)
 
 CLOUD_RUN_BASE = "https://comprehendase-backend-470914920668.us-east4.run.app"
 
 
+# ---------------------------------------------------------
+# Columnar (one array per field) response layout
+# ---------------------------------------------------------
+# A document can have thousands of words; sending each as an object repeats
+# every key thousands of times. Words go out as parallel arrays instead, and
+# phrases (always a run of consecutive words) as [start, end) word indices.
+WORD_FIELDS = ("text", "page", "x", "y", "width", "height", "definition", "source")
+
+
+def columnar_words(words):
+    """Turn a list of word dicts into {field: [value per word]}; missing fields are None."""
+    return {field: [w.get(field) for w in words] for field in WORD_FIELDS}
+
+
+def columnar_phrases(phrases, words):
+    """Turn phrase dicts into text plus start/end indices into `words`."""
+    index = {id(w): i for i, w in enumerate(words)}
+    starts = [index[id(p["words"][0])] for p in phrases]
+    return {
+        "text": [p["text"] for p in phrases],
+        "start": starts,
+        "end": [start + len(p["words"]) for start, p in zip(starts, phrases)]
+    }
+
+
 # ---------------------------------------------------------
 # Serve rendered page images
 # ---------------------------------------------------------
+# Every render goes into a fresh, uniquely named folder, so a page image
+# never changes once written and browsers/CDNs can keep it.
+PAGE_IMAGE_MAX_AGE = 24 * 3600
+
+
 @app.route("/static/pages/<path:filename>")
 def serve_page_image(filename):
-    return send_from_directory("/tmp/pages", filename)
+    # Under gunicorn the body goes out through wsgi.file_wrapper (sendfile),
+    # so the worker thread doesn't copy the image through Python
+    return send_from_directory(STATIC_PAGE_FOLDER, filename, max_age=PAGE_IMAGE_MAX_AGE)
 
 
 # ---------------------------------------------------------
@@ -40,13 +100,19 @@ def extract():
     if request.method == "OPTIONS":
         return '', 204
 
+    # Give this request its own debug collector, so requests handled on
+    # other threads at the same time don't mix into its report
+    DEBUG.start_request()
+
     # If you prefer per-request control, you can enable here instead:
     # DEBUG.enable()
 
     DEBUG.add_flow("request_received")
 
+    # Step timings (seconds since the request arrived), printed as a single
+    # line once the response is ready rather than one write per step
     start_time = time.time()
-    print("Received request")
+    timings = []
 
     # Validate upload
     if "file" not in request.files:
@@ -56,25 +122,54 @@ def extract():
     pdf_file = request.files["file"]
     filename = secure_filename(pdf_file.filename)
     filepath = os.path.join(UPLOAD_FOLDER, filename)
-    pdf_file.save(filepath)
+    # Werkzeug already spools large uploads to a temp file; copy it out in
+    # 1 MiB chunks, hashing the bytes on the way for the response cache
+    digest = hashlib.blake2b()
+    with open(filepath, "wb") as out:
+        for chunk in iter(lambda: pdf_file.stream.read(1 << 20), b""):
+            digest.update(chunk)
+            out.write(chunk)
+    upload_key = digest.hexdigest()
 
     DEBUG.add_flow(f"file_saved:{filename}")
-    print(f"Saved file: {filename}")
+
+    # The same PDF uploaded again gets the stored response, as long as the
+    # page images it points at are still on disk
+    cached = RESPONSE_CACHE.get(upload_key)
+    if cached is not None:
+        body, page_folder = cached
+        if os.path.isdir(os.path.join(STATIC_PAGE_FOLDER, page_folder)):
+            DEBUG.add_flow("response_cache_hit")
+            print(f"Processed {filename} — cached {time.time() - start_time:.2f}s")
+            return app.response_class(body, mimetype="application/json")
 
     # -----------------------------------------------------
     # 1. Extract layout (GLOBAL words + phrases)
     # -----------------------------------------------------
     DEBUG.add_flow("layout_extraction_started")
-    render_result = render_pdf_pages(filepath)
+
+    # The first render and the OCR pass both only need the uploaded file.
+    # PyMuPDF isn't thread-safe, so OCR (or the embedded-text probe) runs in
+    # a worker process while the pages render from this thread.
+    finish_ocr = start_ocr_pdf(filepath)
+    render_result = render_pdf_pages(filepath, output_folder=STATIC_PAGE_FOLDER)
+    cleaned_pdf = finish_ocr()
     render_metadata = render_result["images"]
 
-    target_pdf, extracted = extract_pdf_layout(filepath, render_metadata)
+    if cleaned_pdf:
+        DEBUG.add_flow("using_ocr_cleaned_pdf")
+    else:
+        DEBUG.add_flow("using_original_pdf_no_ocr")
+
+    target_pdf, extracted = extract_pdf_layout(
+        cleaned_pdf or filepath, render_metadata, run_ocr=False
+    )
     pages_meta = extracted["pages"]
     all_words = extracted["words"]
     all_phrases = extracted["phrases"]
 
     DEBUG.add_flow("layout_extraction_completed")
-    print(f"Extraction complete — {time.time() - start_time:.2f}s")
+    timings.append(("extraction", time.time() - start_time))
 
     # Set counts after extraction
     DEBUG.set_count("pages", len(pages_meta))
@@ -94,35 +189,52 @@ def extract():
 
     # -----------------------------------------------------
     # 2. Render images from the SAME PDF used for extraction
+    # 3. Ontology lookup (Phase‑1 pipeline)
     # -----------------------------------------------------
+    # The first render already wrote the upload's pages into the static
+    # folder; only an OCR rewrite makes them differ from target_pdf. When it
+    # does, re-render on a helper thread while the lookup (mostly waiting on
+    # BioPortal) runs here: the two share no inputs. The helper runs in a
+    # copy of this context so its debug flow lands in this request's report.
     DEBUG.add_flow("page_rendering_started")
-    render_result = render_pdf_pages(target_pdf, output_folder=STATIC_PAGE_FOLDER)
-    image_folder = render_result["folder"]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if target_pdf != filepath:
+            render_future = executor.submit(
+                contextvars.copy_context().run,
+                render_pdf_pages, target_pdf, output_folder=STATIC_PAGE_FOLDER
+            )
+        else:
+            render_future = None
+            DEBUG.add_flow("page_rendering_reused")
+
+        DEBUG.add_flow("ontology_lookup_started")
+        unified_hits = ontology.extract_ontology_terms({
+            "words": all_words,
+            "phrases": all_phrases
+        })
+        DEBUG.add_flow("ontology_lookup_completed")
+        if unified_hits["_lookup_failed"]:
+            DEBUG.add_flow(f"ontology_lookup_failed:{len(unified_hits['_lookup_failed'])}")
+        timings.append(("ontology", time.time() - start_time))
+
+        if render_future is not None:
+            render_result = render_future.result()
     image_list = render_result["images"]
 
     DEBUG.add_flow("page_rendering_completed")
-    print(f"Rendering complete — {time.time() - start_time:.2f}s")
-
-    # -----------------------------------------------------
-    # 3. Ontology lookup (Phase‑1 pipeline)
-    # -----------------------------------------------------
-    DEBUG.add_flow("ontology_lookup_started")
-    unified_hits = ontology.extract_ontology_terms({
-        "words": all_words,
-        "phrases": all_phrases
-    })
-    DEBUG.add_flow("ontology_lookup_completed")
-
-    print(f"Ontology lookup complete — {time.time() - start_time:.2f}s")
+    timings.append(("rendering", time.time() - start_time))
 
     # -----------------------------------------------------
     # 4. Attach definitions to phrases and words
     # -----------------------------------------------------
 
+    # Word and phrase texts come out of extraction already trimmed (words
+    # are split on whitespace, phrases are those words joined by spaces), so
+    # they are used as lookup keys directly.
+
     # PHRASE LOOP — only phrase-level hits
     for phrase_obj in all_phrases:
-        phrase_text = phrase_obj["text"].strip()
-        hit = unified_hits.get(phrase_text)
+        hit = unified_hits.get(phrase_obj["text"])
 
         if not hit:
             continue
@@ -139,30 +251,34 @@ def extract():
 
         # No other phrase-level cases exist in Phase‑1
 
-    # WORD LOOP — apply word-level hits
+    # WORD LOOP — apply word-level hits, and count defined words in the same
+    # pass (every word is visited after the phrase loop, so this sees both)
+    definitions_count = 0
+    words_with_def = []  # a few words that actually have definitions
+
     for w in all_words:
-        word_text = w["text"].strip()
-        hit = unified_hits.get(word_text)
+        hit = unified_hits.get(w["text"])
 
-        if not hit:
-            continue
+        if hit:
+            source = hit.get("source")
 
-        source = hit.get("source")
+            if source in ("word_definition", "ontology_word"):
+                definition = hit.get("definition")
+                if definition:
+                    w["definition"] = definition
+                    w["source"] = source
 
-        if source in ("word_definition", "ontology_word"):
-            definition = hit.get("definition")
-            if definition:
-                w["definition"] = definition
-                w["source"] = source
+        if "definition" in w:
+            definitions_count += 1
+            if len(words_with_def) < 5:
+                words_with_def.append(w)
 
     DEBUG.add_flow("definitions_attached")
 
     # Count how many words ended up with definitions
-    definitions_count = sum(1 for w in all_words if "definition" in w)
     DEBUG.set_count("definitions", definitions_count)
 
     # Sample a few words that actually have definitions
-    words_with_def = [w for w in all_words if "definition" in w][:5]
     for w in words_with_def:
         DEBUG.add_sample("definitions", w)
 
@@ -170,14 +286,10 @@ def extract():
     # 5. Attach image URLs
     # -----------------------------------------------------
     DEBUG.add_flow("image_url_attachment_started")
+    # Build every page's URL once; pages that failed to render get None
+    urls = {img["page"]: f"{CLOUD_RUN_BASE}/{img['path']}" for img in image_list}
     for page in pages_meta:
-        page_number = page["page_number"]
-        match = next((img for img in image_list if img["page"] == page_number), None)
-
-        if match:
-            page["image_url"] = f"{CLOUD_RUN_BASE}/{match['path']}"
-        else:
-            page["image_url"] = None
+        page["image_url"] = urls.get(page["page_number"])
 
     DEBUG.add_flow("image_url_attachment_completed")
 
@@ -185,18 +297,24 @@ def extract():
     # 6. Return unified output
     # -----------------------------------------------------
     DEBUG.add_flow("response_ready")
-    print(f"Finished all processing — {time.time() - start_time:.2f}s")
+    timings.append(("finished", time.time() - start_time))
+    print(f"Processed {filename} — " + ", ".join(f"{step} {t:.2f}s" for step, t in timings))
 
     # Emit a single consolidated debug report (if enabled)
     report = DEBUG.emit()
     if report:
         print(report)
 
-    return jsonify({
+    response = jsonify({
         "pages": pages_meta,
-        "words": all_words,
-        "phrases": all_phrases
+        "words": columnar_words(all_words),
+        "phrases": columnar_phrases(all_phrases, all_words)
     })
+    # A response that is missing definitions because BioPortal requests
+    # failed isn't cached, so re-uploading the PDF retries those lookups
+    if not unified_hits["_lookup_failed"]:
+        RESPONSE_CACHE.set(upload_key, response.get_data(), render_result["folder"])
+    return response
 
 
 # ---------------------------------------------------------
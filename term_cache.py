@@ -0,0 +1,165 @@
+# term_cache.py
+# A persistent cache for ontology lookups: in-process LRU in front of SQLite.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by get(key, MISSING) when a key was never cached (or has expired),
+# as opposed to a cached None meaning "known to have no match".
+MISSING = object()
+
+class TermCache:
+    """
+    Remembers lookup results across requests. Hot entries live in an
+    in-process LRU; every write also goes to a SQLite file, so a warm cache
+    answers without touching the network. The file only outlives the
+    container if its path is on persistent storage.
+    A stored None is a negative entry ("looked up, no match"); it expires
+    sooner than a hit so a term that gains a definition is retried.
+    Cache failures are swallowed: a broken cache only means a miss.
+    """
+
+    def __init__(self, path, ttl=30 * 86400, negative_ttl=7 * 86400, memory_size=16384):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # key -> (value, stored)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _db(self):
+        """
+        Open the SQLite store on first use, and again in a forked worker:
+        a SQLite connection must not be carried across fork().
+        """
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS terms ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key, value, stored):
+        self._memory[key] = (value, stored)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _expired(self, value, stored, now):
+        ttl = self.negative_ttl if value is None else self.ttl
+        return now - stored > ttl
+
+    def _from_memory(self, key, now):
+        """The in-memory value for `key`, or MISSING if absent or expired."""
+        entry = self._memory.get(key)
+        if entry is None:
+            return MISSING
+        value, stored = entry
+        if self._expired(value, stored, now):
+            del self._memory[key]
+            return MISSING
+        self._memory.move_to_end(key)
+        return value
+
+    def _load(self, value, stored, now):
+        """Decode a stored row; MISSING if it has outlived its TTL."""
+        value = json.loads(value)
+        return MISSING if self._expired(value, stored, now) else value
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key` (None for a negative entry),
+        or `default` if missing or expired.
+        """
+        with self._lock:
+            now = time.time()
+            value = self._from_memory(key, now)
+            if value is not MISSING:
+                return value
+
+            try:
+                row = self._db().execute(
+                    "SELECT value, stored FROM terms WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                return default
+
+            if row is None:
+                return default
+            value = self._load(row[0], row[1], now)
+            if value is MISSING:
+                return default
+            self._remember(key, value, row[1])
+            return value
+
+    def get_many(self, keys):
+        """
+        Return {key: value} for every key that is cached and fresh;
+        negative entries are included with a value of None.
+        Memory is checked first; the rest are fetched in a few IN queries
+        rather than one round trip per key.
+        """
+        found = {}
+        with self._lock:
+            now = time.time()
+            missing = []
+            for key in keys:
+                value = self._from_memory(key, now)
+                if value is MISSING:
+                    missing.append(key)
+                else:
+                    found[key] = value
+
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                try:
+                    rows = self._db().execute(
+                        f"SELECT key, value, stored FROM terms WHERE key IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                except sqlite3.Error:
+                    break
+                for key, value, stored in rows:
+                    value = self._load(value, stored, now)
+                    if value is MISSING:
+                        continue
+                    self._remember(key, value, stored)
+                    found[key] = value
+        return found
+
+    def set(self, key, value):
+        """Store a JSON-serializable value (None for "no match") under `key`."""
+        with self._lock:
+            now = time.time()
+            self._remember(key, value, now)
+            try:
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO terms (key, value, stored) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+
+# A single shared cache for BioPortal lookups. The default path is under
+# /tmp, which on Cloud Run is in memory and private to each instance, so
+# there the cache lasts as long as the instance; point ONTOLOGY_CACHE_PATH
+# at a mounted volume to keep it across restarts.
+TERM_CACHE = TermCache(
+    os.environ.get("ONTOLOGY_CACHE_PATH", "/tmp/ontology_cache.sqlite3")
+)